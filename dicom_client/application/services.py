@@ -1,15 +1,23 @@
-import json
+import atexit
+import logging
+import orjson
 from datetime import datetime
 from typing import Dict, Any
 from pathlib import Path
 
 
+logger = logging.getLogger(__name__)
+
+
 class LoggingService:
     """Сервис логирования"""
     
     def __init__(self, log_file: str = "dicom_client.log"):
         self.log_file = log_file
         Path(self.log_file).parent.mkdir(parents=True, exist_ok=True)
+        # Файл лога открывается один раз и сбрасывается на диск при выходе
+        self._fh = open(self.log_file, 'ab', buffering=1 << 16)
+        atexit.register(self._fh.close)
     
     def log_operation(self, operation: str, status: str, details: Dict[str, Any]):
         """Записать операцию в лог"""
@@ -21,10 +29,13 @@ class LoggingService:
         }
         
         try:
-            with open(self.log_file, 'a') as f:
-                f.write(json.dumps(log_entry) + '\n')
+            self._fh.write(orjson.dumps(log_entry) + b'\n')
         except IOError as e:
-            print(f"Ошибка при записи в лог: {e}")
+            logger.error("Ошибка при записи в лог: %s", e)
+    
+    def close(self):
+        """Закрыть файл лога"""
+        self._fh.close()
 
 
 class StatisticsService:
@@ -35,8 +46,9 @@ class StatisticsService:
     
     def get_storage_statistics(self) -> Dict[str, Any]:
         """Получить статистику локального хранилища"""
+        storage_size = self.file_repo.get_storage_size()
         return {
             'total_patients': len(self.file_repo.list_patients()),
-            'storage_size_bytes': self.file_repo.get_storage_size(),
-            'storage_size_mb': self.file_repo.get_storage_size() / (1024 * 1024)
+            'storage_size_bytes': storage_size,
+            'storage_size_mb': storage_size / (1024 * 1024)
         }
\ No newline at end of file
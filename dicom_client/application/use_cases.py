@@ -1,6 +1,33 @@
-from typing import List, Optional
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, List, Optional
 from domain.entities import DicomInstance
-from domain.repositories import IDicomRepository, IFileRepository
+from domain.repositories import IDicomRepository, IAsyncDicomRepository, IFileRepository
+
+
+logger = logging.getLogger(__name__)
+
+
+class _DownloadFailed(Exception):
+    """Скачивание прервано; запись временного файла отменяется"""
+
+
+@asynccontextmanager
+async def _open_for_write_async(file_repo: IFileRepository, file_path: str) -> AsyncIterator[BinaryIO]:
+    """
+    Асинхронная обертка над open_for_write: открытие, закрытие
+    и переименование файла блокируют, поэтому выполняются вне event loop
+    """
+    writer = file_repo.open_for_write(file_path)
+    fp = await asyncio.to_thread(writer.__enter__)
+    try:
+        yield fp
+    except BaseException as e:
+        if not await asyncio.to_thread(writer.__exit__, type(e), e, e.__traceback__):
+            raise
+    else:
+        await asyncio.to_thread(writer.__exit__, None, None, None)
 
 
 class DownloadDicomUseCase:
@@ -15,42 +42,33 @@ class DownloadDicomUseCase:
         # Получаем информацию об инстансе
         instance = self.dicom_repo.get_instance(instance_id)
         if not instance:
-            print(f"Инстанс {instance_id} не найден")
+            logger.warning("Инстанс %s не найден", instance_id)
             return None
         
-        # Скачиваем файл
-        temp_path = f"/tmp/{instance_id}.dcm"
-        if not self.dicom_repo.download_instance(instance_id, temp_path):
-            print(f"Ошибка при скачивании инстанса {instance_id}")
-            return None
+        # Скачиваем файл сразу в структурированное хранилище
+        file_path = self.file_repo.get_file_path(
+            instance.patient_id,
+            instance.study_id,
+            instance.series_id,
+            instance.id
+        )
         
-        # Читаем скачанный файл
+        # Репозиторий пишет во временный файл и удаляет его при исключении,
+        # поэтому неудачное скачивание прерываем собственным исключением
         try:
-            with open(temp_path, 'rb') as f:
-                content = f.read()
-        except IOError as e:
-            print(f"Ошибка при чтении временного файла: {e}")
+            with self.file_repo.open_for_write(file_path) as f:
+                if not self.dicom_repo.stream_instance_to(instance_id, f):
+                    raise _DownloadFailed()
+        except _DownloadFailed:
+            logger.error("Ошибка при скачивании инстанса %s", instance_id)
             return None
-        
-        # Сохраняем в структурированное хранилище
-        try:
-            file_path = self.file_repo.save_dicom_file(
-                content,
-                instance.patient_id,
-                instance.study_id,
-                instance.series_id,
-                instance.id
-            )
-            print(f"Файл сохранен: {file_path}")
-            return file_path
         except Exception as e:
-            print(f"Ошибка при сохранении файла: {e}")
+            # Поток записи может упасть не только с IOError
+            logger.error("Не удалось сохранить инстанс %s: %s", instance_id, e)
             return None
-        finally:
-            # Удаляем временный файл
-            import os
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        
+        logger.info("Файл сохранен: %s", file_path)
+        return file_path
 
 
 class UploadDicomUseCase:
@@ -87,16 +105,74 @@ class SyncDicomUseCase:
         instances = self.dicom_repo.list_instances(limit)
         downloaded_files = []
         
-        print(f"Найдено {len(instances)} инстансов для синхронизации")
+        logger.info("Найдено %s инстансов для синхронизации", len(instances))
+        
+        use_case = DownloadDicomUseCase(self.dicom_repo, self.file_repo)
         
         for i, instance in enumerate(instances, 1):
-            print(f"Скачивание {i}/{len(instances)}: {instance.id}")
+            logger.info("Скачивание %s/%s: %s", i, len(instances), instance.id)
             
-            use_case = DownloadDicomUseCase(self.dicom_repo, self.file_repo)
             file_path = use_case.execute(instance.id)
             
             if file_path:
                 downloaded_files.append(file_path)
         
-        print(f"Успешно скачано {len(downloaded_files)} файлов")
-        return downloaded_files
\ No newline at end of file
+        logger.info("Успешно скачано %s файлов", len(downloaded_files))
+        return downloaded_files
+
+
+class ConcurrentSyncDicomUseCase:
+    """Сценарий параллельной синхронизации DICOM файлов"""
+    
+    def __init__(self, dicom_repo: IAsyncDicomRepository, file_repo: IFileRepository,
+                 max_concurrency: int = 20):
+        self.dicom_repo = dicom_repo
+        self.file_repo = file_repo
+        self.max_concurrency = max_concurrency
+    
+    async def execute(self, limit: int = 100) -> List[str]:
+        """Синхронизировать все инстансы с сервера параллельно"""
+        async with self.dicom_repo:
+            instances = await self.dicom_repo.list_instances(limit)
+            
+            logger.info("Найдено %s инстансов для синхронизации", len(instances))
+            
+            # Ограничиваем количество одновременных скачиваний
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            
+            async def download(instance: DicomInstance) -> Optional[str]:
+                async with semaphore:
+                    return await self._download(instance)
+            
+            tasks = [download(instance) for instance in instances]
+            results = await asyncio.gather(*tasks)
+        
+        downloaded_files = [file_path for file_path in results if file_path]
+        
+        logger.info("Успешно скачано %s файлов", len(downloaded_files))
+        return downloaded_files
+    
+    async def _download(self, instance: DicomInstance) -> Optional[str]:
+        """Скачать один инстанс и сохранить в структурированном виде"""
+        file_path = self.file_repo.get_file_path(
+            instance.patient_id,
+            instance.study_id,
+            instance.series_id,
+            instance.id
+        )
+        
+        # Файл принимается блоками прямо во временный файл хранилища,
+        # не собираясь целиком в памяти
+        try:
+            async with _open_for_write_async(self.file_repo, file_path) as f:
+                if not await self.dicom_repo.stream_instance_to(instance.id, f):
+                    raise _DownloadFailed()
+        except _DownloadFailed:
+            logger.error("Ошибка при скачивании инстанса %s", instance.id)
+            return None
+        except Exception as e:
+            logger.error("Не удалось сохранить инстанс %s: %s", instance.id, e)
+            return None
+        
+        logger.info("Файл сохранен: %s", file_path)
+        return file_path
\ No newline at end of file
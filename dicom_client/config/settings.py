@@ -1,5 +1,6 @@
 import os
-from pydantic import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 
 
@@ -17,9 +18,16 @@ class Settings(BaseSettings):
     # Таймауты для HTTP запросов
     REQUEST_TIMEOUT: int = 30
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    # Максимальное количество параллельных HTTP запросов
+    MAX_CONCURRENT_REQUESTS: int = 20
+    
+    # Запись DICOM файлов в обход page cache (O_DIRECT, только Linux)
+    USE_DIRECT_IO: bool = False
+    
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Получить настройки приложения (создаются при первом обращении)"""
+    return Settings()
\ No newline at end of file
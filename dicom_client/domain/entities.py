@@ -12,7 +12,7 @@ class ResourceType(Enum):
     INSTANCE = "Instance"
 
 
-@dataclass
+@dataclass(slots=True)
 class DicomInstance:
     """DICOM инстанс - минимальная единица DICOM данных"""
     id: str
@@ -30,7 +30,7 @@ class DicomInstance:
             self.metadata = {}
 
 
-@dataclass
+@dataclass(slots=True)
 class DicomSeries:
     """Серия DICOM снимков"""
     id: str
@@ -44,7 +44,7 @@ class DicomSeries:
             self.instances = []
 
 
-@dataclass
+@dataclass(slots=True)
 class DicomStudy:
     """Исследование пациента"""
     id: str
@@ -58,7 +58,7 @@ class DicomStudy:
             self.series = []
 
 
-@dataclass
+@dataclass(slots=True)
 class DicomPatient:
     """Пациент"""
     id: str
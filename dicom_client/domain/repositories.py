@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import BinaryIO, ContextManager, List, Optional, Union
 from domain.entities import DicomInstance, DicomPatient, DicomStudy, DicomSeries
 
 
@@ -21,6 +21,11 @@ class IDicomRepository(ABC):
         """Скачать DICOM файл"""
         pass
     
+    @abstractmethod
+    def stream_instance_to(self, instance_id: str, fp: BinaryIO) -> bool:
+        """Записать DICOM файл в открытый файловый объект потоком"""
+        pass
+    
     @abstractmethod
     def upload_instance(self, file_path: str) -> Optional[DicomInstance]:
         """Загрузить DICOM файл"""
@@ -36,12 +41,22 @@ class IFileRepository(ABC):
     """Интерфейс репозитория для работы с файловой системой"""
     
     @abstractmethod
-    def save_dicom_file(self, content: bytes, patient_id: str, 
+    def save_dicom_file(self, content: Union[bytes, memoryview], patient_id: str, 
                        study_id: str, series_id: str, 
                        instance_id: str) -> str:
         """Сохранить DICOM файл в структурированном виде"""
         pass
     
+    @abstractmethod
+    def open_for_write(self, file_path: str) -> ContextManager[BinaryIO]:
+        """Открыть файл для атомарной записи (временный файл + переименование)"""
+        pass
+    
+    @abstractmethod
+    def ensure_directory(self, directory: str):
+        """Создать директорию для файлов"""
+        pass
+    
     @abstractmethod
     def read_dicom_file(self, file_path: str) -> bytes:
         """Прочитать DICOM файл"""
@@ -51,4 +66,38 @@ class IFileRepository(ABC):
     def get_file_path(self, patient_id: str, study_id: str, 
                      series_id: str, instance_id: str) -> str:
         """Получить путь к файлу"""
+        pass
+
+class IAsyncDicomRepository(ABC):
+    """Интерфейс асинхронного репозитория для работы с DICOM данными"""
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    @abstractmethod
+    async def get_instance(self, instance_id: str) -> Optional[DicomInstance]:
+        """Получить DICOM инстанс по ID"""
+        pass
+    
+    @abstractmethod
+    async def list_instances(self, limit: int = 100) -> List[DicomInstance]:
+        """Получить список DICOM инстансов"""
+        pass
+    
+    @abstractmethod
+    async def get_instance_file(self, instance_id: str) -> Optional[bytes]:
+        """Получить содержимое DICOM файла"""
+        pass
+    
+    @abstractmethod
+    async def stream_instance_to(self, instance_id: str, fp: BinaryIO) -> bool:
+        """Записать DICOM файл в открытый файловый объект потоком"""
+        pass
+    
+    @abstractmethod
+    async def close(self):
+        """Закрыть соединения с сервером"""
         pass
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import aiohttp
+from typing import BinaryIO, Dict, List, Optional, Any
+from domain.repositories import IAsyncDicomRepository
+from domain.entities import DicomInstance
+from config.settings import get_settings
+from infrastructure.orthanc_common import (
+    PARENT_CACHE_SIZE,
+    BoundedCache,
+    expanded_series_ids,
+    instance_metadata,
+    instances_from_expanded,
+    is_expanded_listing,
+    unique_ids
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOrthancClient(IAsyncDicomRepository):
+    """Асинхронный клиент для работы с Orthanc сервером"""
+    
+    # Размер блока при потоковом скачивании файлов
+    _DOWNLOAD_CHUNK_SIZE = 1 << 20
+    
+    def __init__(self, base_url: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, full_metadata: bool = False):
+        settings = get_settings()
+        self.full_metadata = full_metadata
+        self.base_url = (base_url or settings.ORTHANC_URL).rstrip('/')
+        self.auth = aiohttp.BasicAuth(
+            username if username is not None else settings.ORTHANC_USERNAME,
+            password if password is not None else settings.ORTHANC_PASSWORD
+        )
+        # Как и timeout в requests, ограничиваем только подключение и каждое
+        # чтение: общий лимит обрывал бы большие файлы, пока данные еще идут
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=settings.REQUEST_TIMEOUT,
+            sock_read=settings.REQUEST_TIMEOUT
+        )
+        self.max_connections = settings.MAX_CONCURRENT_REQUESTS
+        self.session: Optional[aiohttp.ClientSession] = None
+        
+        # Связи ресурсов с родителями в Orthanc неизменны, поэтому их можно кэшировать
+        self._parent_cache = BoundedCache(PARENT_CACHE_SIZE)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получить HTTP сессию, создав ее при первом обращении"""
+        # Сессия должна создаваться внутри работающего event loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                auth=self.auth,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        return self.session
+    
+    async def close(self):
+        """Закрыть HTTP сессию"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+    
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
+        """Выполнить HTTP запрос к Orthanc API"""
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        
+        try:
+            async with self._get_session().request(method, url, **kwargs) as response:
+                response.raise_for_status()
+                
+                # Возвращаем JSON для соответствующих ответов
+                if response.content_type == 'application/json':
+                    return await response.json()
+                return await response.read()
+        
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка при запросе к Orthanc: %s", e)
+            return None
+    
+    async def get_instance(self, instance_id: str) -> Optional[DicomInstance]:
+        """Получить информацию о DICOM инстансе"""
+        data = await self._make_request('GET', f'/instances/{instance_id}')
+        
+        if not data:
+            return None
+        
+        # Серия известна из ответа, а исследование и пациент берутся из описаний
+        # серии и исследования, которые кэшируются и общие для соседних инстансов
+        series_id = data.get('ParentSeries') or await self._get_parent(instance_id, 'series')
+        study_id = await self._get_resource_parent('series', series_id, 'ParentStudy') if series_id else None
+        patient_id = await self._get_resource_parent('studies', study_id, 'ParentPatient') if study_id else None
+        
+        return DicomInstance(
+            id=instance_id,
+            patient_id=patient_id or '',
+            study_id=study_id or '',
+            series_id=series_id or '',
+            file_size=data.get('FileSize'),
+            metadata=instance_metadata(data, self.full_metadata)
+        )
+    
+    async def list_instances(self, limit: int = 100) -> List[DicomInstance]:
+        """Получить список всех DICOM инстансов"""
+        instances_data = await self._make_request('GET', f'/instances?expand&limit={limit}')
+        
+        if not instances_data or not isinstance(instances_data, list):
+            return []
+        
+        if not is_expanded_listing(instances_data):
+            instances = await asyncio.gather(
+                *(self.get_instance(instance_id) for instance_id in instances_data)
+            )
+            return [instance for instance in instances if instance]
+        
+        return await self._instances_from_expanded(instances_data)
+    
+    async def _instances_from_expanded(self, instances_data: List[Dict]) -> List[DicomInstance]:
+        """Собрать инстансы из развернутого ответа /instances?expand"""
+        series_ids = expanded_series_ids(instances_data)
+        study_ids = await asyncio.gather(
+            *(self._get_resource_parent('series', series_id, 'ParentStudy') for series_id in series_ids)
+        )
+        study_by_series = dict(zip(series_ids, study_ids))
+        
+        study_ids = unique_ids(study_ids)
+        patient_ids = await asyncio.gather(
+            *(self._get_resource_parent('studies', study_id, 'ParentPatient') for study_id in study_ids)
+        )
+        patient_by_study = dict(zip(study_ids, patient_ids))
+        
+        return instances_from_expanded(instances_data, study_by_series, patient_by_study, self.full_metadata)
+    
+    async def get_instance_file(self, instance_id: str) -> Optional[bytes]:
+        """Получить содержимое DICOM файла"""
+        content = await self._make_request('GET', f'/instances/{instance_id}/file')
+        
+        if not content or not isinstance(content, bytes):
+            return None
+        return content
+    
+    async def stream_instance_to(self, instance_id: str, fp: BinaryIO) -> bool:
+        """Записать DICOM файл в открытый файловый объект потоком"""
+        url = f"{self.base_url}/instances/{instance_id}/file"
+        
+        # Запись на диск блокирует, поэтому идет в отдельном потоке,
+        # пока из сети принимается следующий блок
+        pending: Optional[asyncio.Future] = None
+        try:
+            async with self._get_session().get(url) as response:
+                response.raise_for_status()
+                
+                async for chunk in response.content.iter_chunked(self._DOWNLOAD_CHUNK_SIZE):
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.ensure_future(asyncio.to_thread(fp.write, chunk))
+            
+            if pending is not None:
+                await pending
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка при запросе к Orthanc: %s", e)
+            return False
+        except IOError as e:
+            logger.error("Ошибка при сохранении файла: %s", e)
+            return False
+        finally:
+            if pending is not None and not pending.done():
+                # Прием прервался: дожидаемся записи, чтобы она не шла в fp
+                # после возврата. Ее ошибка не должна подменять исходную
+                try:
+                    await pending
+                except Exception:
+                    pass
+    
+    async def _get_parent(self, instance_id: str, parent_type: str) -> Optional[str]:
+        """Получить ID родительского ресурса"""
+        return await self._get_cached_parent(f'/instances/{instance_id}/{parent_type}', 'ID')
+    
+    async def _get_resource_parent(self, resource: str, resource_id: str, parent_field: str) -> Optional[str]:
+        """Получить ID родителя ресурса из его описания"""
+        return await self._get_cached_parent(f'/{resource}/{resource_id}', parent_field)
+    
+    async def _get_cached_parent(self, endpoint: str, field: str) -> Optional[str]:
+        """Получить поле с ID родителя, обращаясь к серверу только при промахе кэша"""
+        key = (endpoint, field)
+        parent_id = self._parent_cache.get(key)
+        if parent_id:
+            return parent_id
+        
+        data = await self._make_request('GET', endpoint)
+        
+        if not data or not isinstance(data, dict):
+            return None
+        
+        parent_id = data.get(field)
+        if parent_id:
+            self._parent_cache.put(key, parent_id)
+        return parent_id
\ No newline at end of file
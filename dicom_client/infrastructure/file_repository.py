@@ -1,41 +1,155 @@
+import io
+import logging
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 from domain.repositories import IFileRepository
-from config.settings import settings
+from config.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class _DirectFileWriter(io.RawIOBase):
+    """
+    Файловый объект для потоковой записи с O_DIRECT. Данные копируются
+    в выровненный буфер и сбрасываются на диск целыми блоками;
+    хвост дописывается с выравниванием и отрезается при закрытии.
+    """
+    
+    def __init__(self, file_path: str, alignment: int, buffer_size: int = 1 << 20):
+        super().__init__()
+        self._alignment = alignment
+        # Анонимный mmap выровнен по границе страницы, как требует O_DIRECT
+        self._buffer = mmap.mmap(-1, buffer_size)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._size = 0
+        try:
+            self._fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o644)
+        except OSError:
+            self._view.release()
+            self._buffer.close()
+            raise
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        data = memoryview(data).cast('B')
+        total = len(data)
+        offset = 0
+        while offset < total:
+            chunk = min(total - offset, len(self._view) - self._filled)
+            self._view[self._filled:self._filled + chunk] = data[offset:offset + chunk]
+            self._filled += chunk
+            offset += chunk
+            if self._filled == len(self._view):
+                self._flush_buffer(self._filled)
+        self._size += total
+        return total
+    
+    def _flush_buffer(self, length: int):
+        """Записать первые length байт буфера (length кратен выравниванию)"""
+        written = 0
+        while written < length:
+            written += os.write(self._fd, self._view[written:length])
+        self._filled = 0
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._filled:
+                alignment = self._alignment
+                self._flush_buffer(-(-self._filled // alignment) * alignment)
+                # Отрезаем выравнивающий хвост
+                os.ftruncate(self._fd, self._size)
+        finally:
+            self._view.release()
+            self._buffer.close()
+            os.close(self._fd)
+            super().close()
 
 
 class FileRepository(IFileRepository):
     """Репозиторий для работы с файловой системой"""
     
+    # Таблица замены недопустимых символов на подчеркивания
+    _SANITIZE_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+    
+    # Выравнивание буфера и размера записи для O_DIRECT
+    _DIRECT_IO_ALIGNMENT = 4096
+    
+    # Количество потоков для подсчета размера хранилища
+    _STORAGE_SCAN_WORKERS = 8
+    
     def __init__(self, base_path: Optional[str] = None):
+        settings = get_settings()
         self.base_path = Path(base_path or settings.LOCAL_STORAGE_PATH)
+        self._base_str = str(self.base_path)
+        self._build_path = self._make_path_builder(self._base_str)
+        self.use_direct_io = settings.USE_DIRECT_IO and hasattr(os, 'O_DIRECT')
+        # Кэш размеров: путь директории -> (mtime_ns, размер файлов, поддиректории)
+        self._dir_size_cache: Dict[str, Tuple[int, int, List[str]]] = {}
+        # Директории, которые уже созданы этим репозиторием
+        self._known_dirs: Set[str] = set()
         self._ensure_directory_exists()
     
     def _ensure_directory_exists(self):
         """Создать базовую директорию если она не существует"""
         self.base_path.mkdir(parents=True, exist_ok=True)
     
-    def save_dicom_file(self, content: bytes, patient_id: str, 
+    def ensure_directory(self, directory: str):
+        """Создать директорию, если она еще не создавалась этим репозиторием"""
+        if directory not in self._known_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._known_dirs.add(directory)
+    
+    def save_dicom_file(self, content: Union[bytes, memoryview], patient_id: str, 
                        study_id: str, series_id: str, 
                        instance_id: str) -> str:
         """
         Сохранить DICOM файл в структурированной директории:
         base_path/patient_id/study_id/series_id/instance_id.dcm
         """
-        # Создаем путь к файлу
         file_path = self.get_file_path(patient_id, study_id, series_id, instance_id)
+        with self.open_for_write(file_path) as f:
+            f.write(content)
+        return file_path
+    
+    @contextmanager
+    def open_for_write(self, file_path: str) -> Iterator[BinaryIO]:
+        """
+        Открыть файл для атомарной записи. Данные пишутся во временный
+        файл, который переименовывается в file_path только при успешном
+        выходе из блока, поэтому при сбое не остается недописанный .dcm.
+        При USE_DIRECT_IO запись идет с O_DIRECT, не засоряя page cache.
+        """
+        directory = os.path.dirname(file_path)
+        self.ensure_directory(directory)
         
-        # Создаем необходимые директории
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        # Сохраняем файл
+        temp_path = file_path + '.tmp'
         try:
-            with open(file_path, 'wb') as f:
-                f.write(content)
-            return file_path
-        except IOError as e:
-            print(f"Ошибка при сохранении файла: {e}")
+            if self.use_direct_io:
+                f = _DirectFileWriter(temp_path, self._DIRECT_IO_ALIGNMENT)
+            else:
+                f = open(temp_path, 'wb', buffering=1 << 20)
+            with f:
+                yield f
+            os.replace(temp_path, file_path)
+        except BaseException as e:
+            # Ошибки файловой системы логируем здесь, а исключения вызывающего
+            # кода (например, прерванное скачивание) только отменяют запись
+            if isinstance(e, OSError):
+                logger.error("Ошибка при сохранении файла: %s", e)
+                # Директория могла быть удалена извне, проверим ее при следующей записи
+                self._known_dirs.discard(directory)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             raise
     
     def read_dicom_file(self, file_path: str) -> bytes:
@@ -44,36 +158,35 @@ class FileRepository(IFileRepository):
             with open(file_path, 'rb') as f:
                 return f.read()
         except IOError as e:
-            print(f"Ошибка при чтении файла: {e}")
+            logger.error("Ошибка при чтении файла: %s", e)
             raise
     
     def get_file_path(self, patient_id: str, study_id: str, 
                      series_id: str, instance_id: str) -> str:
         """Получить путь для сохранения DICOM файла"""
-        # Очищаем ID от недопустимых символов для имен файлов
-        safe_patient_id = self._sanitize_filename(patient_id)
-        safe_study_id = self._sanitize_filename(study_id)
-        safe_series_id = self._sanitize_filename(series_id)
-        safe_instance_id = self._sanitize_filename(instance_id)
+        return self._build_path(patient_id, study_id, series_id, instance_id)
+    
+    @classmethod
+    def _make_path_builder(cls, base: str) -> Callable[[str, str, str, str], str]:
+        """
+        Собрать функцию построения пути base/patient/study/series/instance.dcm.
+        Базовый путь, разделитель и таблица замены недопустимых символов
+        подставляются один раз, поэтому на каждый файл остаются только
+        четыре translate и конкатенация.
+        """
+        prefix = os.path.join(base, '')
         
-        # Создаем путь
-        path = (
-            self.base_path / 
-            safe_patient_id / 
-            safe_study_id / 
-            safe_series_id / 
-            f"{safe_instance_id}.dcm"
-        )
+        def build_path(patient_id: str, study_id: str, series_id: str, instance_id: str,
+                       _prefix=prefix, _sep=os.sep, _table=cls._SANITIZE_TABLE) -> str:
+            return (
+                _prefix +
+                patient_id.translate(_table) + _sep +
+                study_id.translate(_table) + _sep +
+                series_id.translate(_table) + _sep +
+                instance_id.translate(_table) + '.dcm'
+            )
         
-        return str(path)
-    
-    def _sanitize_filename(self, filename: str) -> str:
-        """Очистить имя файла от недопустимых символов"""
-        # Заменяем недопустимые символы на подчеркивания
-        invalid_chars = '<>:"/\\|?*'
-        for char in invalid_chars:
-            filename = filename.replace(char, '_')
-        return filename
+        return build_path
     
     def list_patients(self) -> list:
         """Получить список пациентов в локальном хранилище"""
@@ -85,9 +198,38 @@ class FileRepository(IFileRepository):
     
     def get_storage_size(self) -> int:
         """Получить общий размер хранилища в байтах"""
-        total_size = 0
-        for root, dirs, files in os.walk(self.base_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                total_size += os.path.getsize(file_path)
-        return total_size
\ No newline at end of file
+        files_size, patient_dirs = self._scan_directory(self._base_str)
+        
+        # Поддеревья пациентов обходятся параллельно: на сетевых ФС
+        # время уходит в основном на ожидание stat
+        with ThreadPoolExecutor(max_workers=self._STORAGE_SCAN_WORKERS) as executor:
+            return files_size + sum(executor.map(self._subtree_size, patient_dirs))
+    
+    def _subtree_size(self, path: str) -> int:
+        """Получить размер поддерева директории"""
+        files_size, subdirs = self._scan_directory(path)
+        return files_size + sum(self._subtree_size(subdir) for subdir in subdirs)
+    
+    def _scan_directory(self, path: str) -> Tuple[int, List[str]]:
+        """
+        Получить суммарный размер файлов директории и список ее поддиректорий.
+        Содержимое директории пересчитывается только при изменении ее mtime,
+        то есть при добавлении, удалении или переименовании записей.
+        """
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._dir_size_cache.get(path)
+        
+        if cached and cached[0] == mtime_ns:
+            _, files_size, subdirs = cached
+        else:
+            files_size = 0
+            subdirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        files_size += entry.stat(follow_symlinks=False).st_size
+            self._dir_size_cache[path] = (mtime_ns, files_size, subdirs)
+        
+        return files_size, subdirs
\ No newline at end of file
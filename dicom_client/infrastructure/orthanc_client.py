@@ -1,23 +1,67 @@
+import logging
 import requests
 import json
-from typing import Dict, List, Optional, Any
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Any
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
 from domain.repositories import IDicomRepository
 from domain.entities import DicomInstance
-from config.settings import settings
+from config.settings import get_settings
+from infrastructure.orthanc_common import (
+    PARENT_CACHE_SIZE,
+    BoundedCache,
+    expanded_series_ids,
+    instance_metadata,
+    instances_from_expanded,
+    is_expanded_listing,
+    unique_ids
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 class OrthancClient(IDicomRepository):
     """Клиент для работы с Orthanc сервером"""
     
-    def __init__(self):
-        self.base_url = settings.ORTHANC_URL.rstrip('/')
+    # Размер блока и глубина очереди при потоковом скачивании файлов
+    _DOWNLOAD_CHUNK_SIZE = 1 << 20
+    _DOWNLOAD_QUEUE_SIZE = 8
+    
+    def __init__(self, base_url: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, full_metadata: bool = False):
+        settings = get_settings()
+        self.full_metadata = full_metadata
+        self.base_url = (base_url or settings.ORTHANC_URL).rstrip('/')
         self.auth = HTTPBasicAuth(
-            settings.ORTHANC_USERNAME, 
-            settings.ORTHANC_PASSWORD
+            username if username is not None else settings.ORTHANC_USERNAME,
+            password if password is not None else settings.ORTHANC_PASSWORD
         )
         self.timeout = settings.REQUEST_TIMEOUT
         
+        # Общая сессия переиспользует TCP соединения между запросами
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+        )
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        self._executor = ThreadPoolExecutor(max_workers=settings.MAX_CONCURRENT_REQUESTS)
+        self._writer_executor = ThreadPoolExecutor(max_workers=settings.MAX_CONCURRENT_REQUESTS)
+        
+        # Связи ресурсов с родителями в Orthanc неизменны, поэтому их можно кэшировать
+        self._parent_cache = BoundedCache(PARENT_CACHE_SIZE)
+        self._parent_cache_lock = threading.Lock()
+        
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
         """Выполнить HTTP запрос к Orthanc API"""
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
@@ -31,7 +75,7 @@ class OrthancClient(IDicomRepository):
             kwargs['timeout'] = self.timeout
         
         try:
-            response = requests.request(method, url, **kwargs)
+            response = self.session.request(method, url, **kwargs)
             response.raise_for_status()
             
             # Возвращаем JSON для соответствующих ответов
@@ -40,7 +84,7 @@ class OrthancClient(IDicomRepository):
             return response.content
             
         except requests.RequestException as e:
-            print(f"Ошибка при запросе к Orthanc: {e}")
+            logger.error("Ошибка при запросе к Orthanc: %s", e)
             return None
     
     def get_instance(self, instance_id: str) -> Optional[DicomInstance]:
@@ -50,10 +94,11 @@ class OrthancClient(IDicomRepository):
         if not data:
             return None
         
-        # Собираем информацию о родительских ресурсах
-        patient_id = self._get_parent(instance_id, 'patient')
-        study_id = self._get_parent(instance_id, 'study')
-        series_id = self._get_parent(instance_id, 'series')
+        # Серия известна из ответа, а исследование и пациент берутся из описаний
+        # серии и исследования, которые кэшируются и общие для соседних инстансов
+        series_id = data.get('ParentSeries') or self._get_parent(instance_id, 'series')
+        study_id = self._get_resource_parent('series', series_id, 'ParentStudy') if series_id else None
+        patient_id = self._get_resource_parent('studies', study_id, 'ParentPatient') if study_id else None
         
         return DicomInstance(
             id=instance_id,
@@ -61,23 +106,39 @@ class OrthancClient(IDicomRepository):
             study_id=study_id or '',
             series_id=series_id or '',
             file_size=data.get('FileSize'),
-            metadata=data
+            metadata=instance_metadata(data, self.full_metadata)
         )
     
     def list_instances(self, limit: int = 100) -> List[DicomInstance]:
         """Получить список всех DICOM инстансов"""
-        instances_data = self._make_request('GET', f'/instances?limit={limit}')
+        instances_data = self._make_request('GET', f'/instances?expand&limit={limit}')
         
         if not instances_data or not isinstance(instances_data, list):
             return []
         
-        instances = []
-        for instance_id in instances_data:
-            instance = self.get_instance(instance_id)
-            if instance:
-                instances.append(instance)
+        if not is_expanded_listing(instances_data):
+            instances = self._executor.map(self.get_instance, instances_data)
+            return [instance for instance in instances if instance]
         
-        return instances
+        return self._instances_from_expanded(instances_data)
+    
+    def _instances_from_expanded(self, instances_data: List[Dict]) -> List[DicomInstance]:
+        """Собрать инстансы из развернутого ответа /instances?expand"""
+        series_ids = expanded_series_ids(instances_data)
+        study_ids = self._executor.map(
+            lambda series_id: self._get_resource_parent('series', series_id, 'ParentStudy'),
+            series_ids
+        )
+        study_by_series = dict(zip(series_ids, study_ids))
+        
+        study_ids = unique_ids(study_by_series.values())
+        patient_ids = self._executor.map(
+            lambda study_id: self._get_resource_parent('studies', study_id, 'ParentPatient'),
+            study_ids
+        )
+        patient_by_study = dict(zip(study_ids, patient_ids))
+        
+        return instances_from_expanded(instances_data, study_by_series, patient_by_study, self.full_metadata)
     
     def download_instance(self, instance_id: str, save_path: str) -> bool:
         """Скачать DICOM файл"""
@@ -91,16 +152,73 @@ class OrthancClient(IDicomRepository):
                 f.write(content)
             return True
         except IOError as e:
-            print(f"Ошибка при сохранении файла: {e}")
+            logger.error("Ошибка при сохранении файла: %s", e)
+            return False
+    
+    def stream_instance_to(self, instance_id: str, fp: BinaryIO) -> bool:
+        """Записать DICOM файл в открытый файловый объект потоком"""
+        url = f"{self.base_url}/instances/{instance_id}/file"
+        
+        try:
+            with self.session.get(url, auth=self.auth, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                
+                # Запись на диск идет в отдельном потоке параллельно с приемом данных
+                chunks = queue.Queue(maxsize=self._DOWNLOAD_QUEUE_SIZE)
+                writer = self._writer_executor.submit(self._write_chunks, chunks, fp)
+                try:
+                    for chunk in response.iter_content(chunk_size=self._DOWNLOAD_CHUNK_SIZE):
+                        self._put_chunk(chunks, chunk, writer)
+                    # Сигнал завершения для потока записи
+                    self._put_chunk(chunks, None, writer)
+                    writer.result()
+                finally:
+                    if not writer.done():
+                        # Прием прервался: дожидаемся потока записи, чтобы он
+                        # не писал в fp после возврата. Его ошибка не должна
+                        # подменять исходную, поэтому здесь она игнорируется
+                        try:
+                            self._put_chunk(chunks, None, writer)
+                            writer.result()
+                        except Exception:
+                            pass
+            return True
+        except (requests.RequestException, Urllib3HTTPError) as e:
+            logger.error("Ошибка при запросе к Orthanc: %s", e)
+            return False
+        except IOError as e:
+            logger.error("Ошибка при сохранении файла: %s", e)
             return False
     
+    @staticmethod
+    def _write_chunks(chunks: queue.Queue, fp: BinaryIO):
+        """Записывать блоки из очереди в файл до получения None"""
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            fp.write(chunk)
+    
+    @staticmethod
+    def _put_chunk(chunks: queue.Queue, chunk: Optional[bytes], writer: Future):
+        """Положить блок в очередь, не зависая если поток записи упал"""
+        while True:
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                if writer.done():
+                    # Пробрасываем ошибку записи
+                    writer.result()
+                    return
+    
     def upload_instance(self, file_path: str) -> Optional[DicomInstance]:
         """Загрузить DICOM файл на Orthanc сервер"""
         try:
             with open(file_path, 'rb') as f:
                 file_content = f.read()
         except IOError as e:
-            print(f"Ошибка при чтении файла: {e}")
+            logger.error("Ошибка при чтении файла: %s", e)
             return None
         
         # Отправляем файл на сервер
@@ -124,15 +242,39 @@ class OrthancClient(IDicomRepository):
     def delete_instance(self, instance_id: str) -> bool:
         """Удалить DICOM инстанс с сервера"""
         response = self._make_request('DELETE', f'/instances/{instance_id}')
+        
+        if response is not None:
+            with self._parent_cache_lock:
+                self._parent_cache.discard((f'/instances/{instance_id}/series', 'ID'))
+        
         return response is not None
     
     def _get_parent(self, instance_id: str, parent_type: str) -> Optional[str]:
         """Получить ID родительского ресурса"""
-        data = self._make_request('GET', f'/instances/{instance_id}/{parent_type}')
+        return self._get_cached_parent(f'/instances/{instance_id}/{parent_type}', 'ID')
+    
+    def _get_resource_parent(self, resource: str, resource_id: str, parent_field: str) -> Optional[str]:
+        """Получить ID родителя ресурса из его описания"""
+        return self._get_cached_parent(f'/{resource}/{resource_id}', parent_field)
+    
+    def _get_cached_parent(self, endpoint: str, field: str) -> Optional[str]:
+        """Получить поле с ID родителя, обращаясь к серверу только при промахе кэша"""
+        key = (endpoint, field)
+        with self._parent_cache_lock:
+            parent_id = self._parent_cache.get(key)
+        if parent_id:
+            return parent_id
+        
+        data = self._make_request('GET', endpoint)
+        
+        if not data or not isinstance(data, dict):
+            return None
         
-        if data and isinstance(data, dict):
-            return data.get('ID')
-        return None
+        parent_id = data.get(field)
+        if parent_id:
+            with self._parent_cache_lock:
+                self._parent_cache.put(key, parent_id)
+        return parent_id
     
     def get_statistics(self) -> Optional[Dict]:
         """Получить статистику сервера"""
@@ -0,0 +1,78 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+from domain.entities import DicomInstance
+
+
+# Максимальное количество закэшированных связей с родительскими ресурсами
+PARENT_CACHE_SIZE = 4096
+
+# Поля ответа /instances/{id}, которые сохраняются в метаданных по умолчанию
+SLIM_METADATA_KEYS = ('FileSize', 'MainDicomTags', 'IndexInSeries')
+
+
+class BoundedCache:
+    """Кэш ограниченного размера: при переполнении вытесняется самая старая запись"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: Dict[Hashable, Any] = {}
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получить значение по ключу"""
+        return self._items.get(key)
+    
+    def put(self, key: Hashable, value: Any):
+        """Сохранить значение, вытеснив самую старую запись при переполнении"""
+        if key not in self._items and len(self._items) >= self.max_size:
+            self._items.pop(next(iter(self._items)))
+        self._items[key] = value
+    
+    def discard(self, key: Hashable):
+        """Удалить запись, если она есть"""
+        self._items.pop(key, None)
+
+
+def instance_metadata(data: Dict, full_metadata: bool = False) -> Dict:
+    """Оставить в метаданных только нужные поля, если не запрошен полный ответ"""
+    if full_metadata:
+        return data
+    return {key: data[key] for key in SLIM_METADATA_KEYS if key in data}
+
+
+def is_expanded_listing(instances_data: List[Any]) -> bool:
+    """Проверить, что ответ /instances?expand содержит описания инстансов"""
+    # Старые версии Orthanc игнорируют expand и возвращают только ID
+    return isinstance(instances_data[0], dict)
+
+
+def expanded_series_ids(instances_data: List[Dict]) -> List[str]:
+    """
+    Получить уникальные ID серий из развернутого ответа /instances?expand.
+    Развернутый инстанс содержит только ParentSeries, поэтому исследование
+    и пациента запрашиваем один раз для каждой уникальной серии и исследования.
+    """
+    return list({data['ParentSeries'] for data in instances_data})
+
+
+def unique_ids(ids: Iterable[Optional[str]]) -> List[str]:
+    """Получить уникальные непустые ID"""
+    return list({resource_id for resource_id in ids if resource_id})
+
+
+def instances_from_expanded(instances_data: List[Dict],
+                            study_by_series: Dict[str, Optional[str]],
+                            patient_by_study: Dict[str, Optional[str]],
+                            full_metadata: bool = False) -> List[DicomInstance]:
+    """Собрать инстансы из развернутого ответа и найденных родительских ресурсов"""
+    instances = []
+    for data in instances_data:
+        study_id = study_by_series.get(data['ParentSeries'])
+        instances.append(DicomInstance(
+            id=data['ID'],
+            patient_id=patient_by_study.get(study_id) or '',
+            study_id=study_id or '',
+            series_id=data['ParentSeries'],
+            file_size=data.get('FileSize'),
+            metadata=instance_metadata(data, full_metadata)
+        ))
+    
+    return instances
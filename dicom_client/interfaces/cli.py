@@ -1,13 +1,16 @@
+import asyncio
 import click
 from typing import Optional
 from application.use_cases import (
     DownloadDicomUseCase,
     UploadDicomUseCase,
     ListInstancesUseCase,
-    SyncDicomUseCase
+    SyncDicomUseCase,
+    ConcurrentSyncDicomUseCase
 )
 from application.services import LoggingService, StatisticsService
 from infrastructure.orthanc_client import OrthancClient
+from infrastructure.async_orthanc_client import AsyncOrthancClient
 from infrastructure.file_repository import FileRepository
 from domain.entities import DicomInstance
 
@@ -25,9 +28,8 @@ from domain.entities import DicomInstance
 def cli(ctx, orthanc_url, username, password, storage_path):
     """CLI для работы с DICOM файлами через Orthanc REST API"""
     # Инициализируем репозитории
-    orthanc_client = OrthancClient()
-    orthanc_client.base_url = orthanc_url
-    orthanc_client.auth = (username, password)
+    orthanc_client = OrthancClient(orthanc_url, username, password)
+    async_orthanc_client = AsyncOrthancClient(orthanc_url, username, password)
     
     file_repo = FileRepository(storage_path)
     
@@ -38,6 +40,7 @@ def cli(ctx, orthanc_url, username, password, storage_path):
     # Сохраняем в контексте
     ctx.obj = {
         'orthanc_client': orthanc_client,
+        'async_orthanc_client': async_orthanc_client,
         'file_repo': file_repo,
         'logging_service': logging_service,
         'stats_service': stats_service
@@ -124,22 +127,28 @@ def list_instances(ctx, limit):
 
 @cli.command()
 @click.option('--limit', default=100, help='Максимальное количество инстансов для синхронизации')
+@click.option('--sequential', is_flag=True, help='Скачивать инстансы последовательно')
 @click.pass_context
-def sync(ctx, limit):
+def sync(ctx, limit, sequential):
     """Синхронизировать все DICOM файлы с сервера"""
     orthanc_client = ctx.obj['orthanc_client']
+    async_orthanc_client = ctx.obj['async_orthanc_client']
     file_repo = ctx.obj['file_repo']
     logging_service = ctx.obj['logging_service']
     
     # Выполняем use case
-    use_case = SyncDicomUseCase(orthanc_client, file_repo)
-    downloaded_files = use_case.execute(limit)
+    if sequential:
+        use_case = SyncDicomUseCase(orthanc_client, file_repo)
+        downloaded_files = use_case.execute(limit)
+    else:
+        use_case = ConcurrentSyncDicomUseCase(async_orthanc_client, file_repo)
+        downloaded_files = asyncio.run(use_case.execute(limit))
     
     # Логируем операцию
     logging_service.log_operation(
         'sync',
         'success',
-        {'downloaded_files': len(downloaded_files), 'limit': limit}
+        {'downloaded_files': len(downloaded_files), 'limit': limit, 'sequential': sequential}
     )
     
     click.echo(f"✅ Синхронизация завершена. Скачано {len(downloaded_files)} файлов")
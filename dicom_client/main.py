@@ -1,3 +1,4 @@
+import logging
 import sys
 from pathlib import Path
 
@@ -7,4 +8,5 @@ sys.path.insert(0, str(Path(__file__).parent))
 from interfaces.cli import cli
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     cli()
\ No newline at end of file
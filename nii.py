@@ -1,18 +1,193 @@
+import io
 import os
 import pydicom
 import nibabel as nib
 import numpy as np
 import json
+try:
+    import orjson
+except ImportError:
+    # orjson не входит в окружение nnU-Net, без него отчет пишется стандартным json
+    orjson = None
 from glob import glob
 from tqdm import tqdm
-import gzip
-import shutil
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import re
+import tempfile
+
+# Теги, которые используются при анализе серий
+METADATA_TAGS = [
+    'SeriesDescription', 'ProtocolName', 'SequenceName', 'ScanOptions',
+    'MRAcquisitionType', 'EchoTime', 'RepetitionTime', 'InversionTime',
+    'ContrastBolusAgent', 'ImageType', 'Modality', 'SeriesNumber',
+    'InstanceNumber', 'SliceThickness', 'PixelSpacing', 'PatientID',
+    'StudyDate', 'PatientName'
+]
+
+
+def extract_dicom_metadata(dcm_file):
+    """Извлечение метаданных из DICOM файла"""
+    try:
+        # Разбираются только нужные теги, остальные элементы пропускаются
+        ds = pydicom.dcmread(dcm_file, stop_before_pixels=True, force=True, specific_tags=METADATA_TAGS)
+        
+        # Безопасное извлечение текстовых полей
+        def safe_get(field, default=''):
+            try:
+                value = ds.get(field, default)
+                if value is None:
+                    return default
+                return str(value).lower().strip()
+            except:
+                return default
+        
+        # Числовое поле читается из набора данных один раз
+        def safe_float(field):
+            value = ds.get(field)
+            return float(value) if value else 0
+        
+        metadata = {
+            'SeriesDescription': safe_get('SeriesDescription'),
+            'ProtocolName': safe_get('ProtocolName'),
+            'SequenceName': safe_get('SequenceName'),
+            'ScanOptions': safe_get('ScanOptions'),
+            'MRAcquisitionType': safe_get('MRAcquisitionType'),
+            'EchoTime': safe_float('EchoTime'),
+            'RepetitionTime': safe_float('RepetitionTime'),
+            'InversionTime': safe_float('InversionTime'),
+            'ContrastBolusAgent': safe_get('ContrastBolusAgent'),
+            'ImageType': safe_get('ImageType'),
+            'Modality': safe_get('Modality'),
+            'SeriesNumber': int(ds.get('SeriesNumber', 0)),
+            'InstanceNumber': int(ds.get('InstanceNumber', 0)),
+            'SliceThickness': safe_float('SliceThickness'),
+            'PixelSpacing': ds.get('PixelSpacing', [1, 1]),
+            'PatientID': safe_get('PatientID'),
+            'StudyDate': safe_get('StudyDate'),
+            'PatientName': safe_get('PatientName')
+        }
+        return metadata
+    except Exception as e:
+        print(f"Ошибка чтения {dcm_file}: {e}")
+        return None
+
+
+def _convert_one(converter, series_key, series_info, output_dir, patient_id, decode_workers):
+    """Конвертация одной серии в дочернем процессе"""
+    print(f"\n{'='*60}")
+    print(f"Обработка серии: {series_key}")
+    return converter.convert_series_to_nifti(series_info, output_dir, patient_id, decode_workers)
+
+
+def iter_decoded_slices(datasets, max_workers):
+    """Декодирование пикселей срезов в пуле потоков, результаты выдаются в исходном порядке
+    
+    Очередь datasets опустошается по ходу работы: pydicom кэширует pixel_array
+    в наборе данных, и ссылка на уже выданный срез не должна оставаться у вызывающего.
+    """
+    # Декодеры сжатых DICOM отпускают GIL, поэтому потоки работают параллельно.
+    # Скользящее окно ограничивает число срезов, одновременно находящихся в памяти
+    window = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as decoder:
+        pending = deque()
+        while datasets:
+            ds = datasets.popleft()
+            pending.append((ds, decoder.submit(getattr, ds, 'pixel_array')))
+            if len(pending) >= window:
+                ds_done, future = pending.popleft()
+                yield ds_done, future.result()
+        
+        while pending:
+            ds_done, future = pending.popleft()
+            yield ds_done, future.result()
+
+
+def is_dicom_file(path):
+    """Быстрая проверка DICOM по первым байтам файла, без разбора pydicom"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(132)
+    except OSError:
+        return False
+    
+    # Стандартный файл: 128 байт преамбулы и маркер DICM
+    if head[128:132] == b'DICM':
+        return True
+    # Набор данных без преамбулы (implicit VR little endian) начинается
+    # с тега группы 0x0002 или 0x0008
+    return head[:2] in (b'\x02\x00', b'\x08\x00')
+
+
+def iter_dicom_files(root):
+    """Рекурсивный обход папки с os.scandir, возвращает пути к DICOM файлам"""
+    # DirEntry берет тип записи из результата readdir, без отдельного stat на файл
+    extensions = ('.dcm', '.dicom', '.ima')
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    
+                    # Файлы без расширения (экспорт с носителей) тоже проверяются,
+                    # кроме индексного файла DICOMDIR, в котором нет изображений
+                    name = entry.name.lower()
+                    if name.endswith(extensions) or ('.' not in name and name != 'dicomdir'):
+                        if is_dicom_file(entry.path):
+                            yield entry.path
+        except OSError:
+            continue
+
+
+class _TellingWriter(io.RawIOBase):
+    """Обертка над потоком сжатия, которая ведет позицию по несжатым данным
+    
+    nibabel сверяет tell() со смещениями заголовка и данных, а потоковый
+    компрессор zstd не поддерживает ни seek, ни tell.
+    """
+    
+    def __init__(self, raw):
+        self._raw = raw
+        self._pos = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._raw.write(data)
+        size = memoryview(data).nbytes
+        self._pos += size
+        return size
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Допускается только переход в текущую позицию
+        target = self._pos + offset if whence == io.SEEK_CUR else offset
+        if whence == io.SEEK_END or target != self._pos:
+            raise io.UnsupportedOperation('seek')
+        return self._pos
+
 
 class DICOMtoNIIConverter:
-    def __init__(self, base_path):
+    # Объемы больше этого размера собираются в файле на диске через np.memmap
+    MEMMAP_THRESHOLD = 512 * 1024 * 1024
+    
+    # Каждый процесс держит в памяти целый объем, поэтому серий одновременно
+    # конвертируется немного, независимо от числа ядер
+    MAX_SERIES_WORKERS = 3
+    
+    def __init__(self, base_path, compression='gzip'):
         self.base_path = base_path
+        # 'gzip' - стандартный .nii.gz, 'zstd' - .nii.zst для собственных читателей
+        if compression not in ('gzip', 'zstd'):
+            raise ValueError(f"Неизвестный тип сжатия: {compression}")
+        self.compression = compression
         self.scan_types_info = {
             'T1': {'keywords': ['t1', 't1_', 't1w', 't1-w', 'mprage', 'bravo', 'spgr'],
                    'TE_range': (2, 30), 'TR_range': (300, 800)},
@@ -26,19 +201,46 @@ class DICOMtoNIIConverter:
                     'TE_range': (50, 100), 'TR_range': (3000, 8000)},
             'ADC': {'keywords': ['adc'], 'TE_range': (50, 100), 'TR_range': (3000, 8000)}
         }
+        
+        # Регулярные выражения для safe_filename компилируются один раз
+        self._invalid_re = re.compile(r'[<>:"/\\|?*:\-><]')
+        self._ws_re = re.compile(r'\s+')
+        self._us_re = re.compile(r'_+')
+        # Непечатаемые символы Latin-1 удаляются через str.translate
+        self._nonprintable_table = dict.fromkeys(i for i in range(256) if not chr(i).isprintable())
+        
+        # Все ключевые слова типов сканов ищутся за один проход по тексту.
+        # Приоритет слова - индекс первого типа, в котором оно встречается
+        self._scan_type_order = list(self.scan_types_info)
+        priority = {}
+        for index, info in enumerate(self.scan_types_info.values()):
+            for keyword in info['keywords']:
+                priority.setdefault(keyword, index)
+        # В одной позиции находится только самое длинное слово, поэтому оно
+        # наследует лучший приоритет своих префиксов
+        self._keyword_priority = {
+            keyword: min(p for other, p in priority.items() if keyword.startswith(other))
+            for keyword in priority
+        }
+        keywords = sorted(self._keyword_priority, key=len, reverse=True)
+        # Опережающая проверка позволяет находить перекрывающиеся вхождения
+        self._keyword_re = re.compile('(?=(' + '|'.join(map(re.escape, keywords)) + '))')
+        # Признаки контраста в описании серии
+        self._contrast_re = re.compile(r'\+c|contrast|ce|post|gd')
     
     def safe_filename(self, filename, max_length=200):
         """Создание безопасного имени файла для Windows"""
         # Удаляем недопустимые символы
-        invalid_chars = r'[<>:"/\\|?*:\-><]'
-        filename = re.sub(invalid_chars, '_', filename)
+        filename = self._invalid_re.sub('_', filename)
         
-        # Удаляем непечатаемые символы
-        filename = ''.join(char for char in filename if char.isprintable())
+        # Удаляем непечатаемые символы; посимвольный обход нужен только за пределами Latin-1
+        filename = filename.translate(self._nonprintable_table)
+        if not filename.isprintable():
+            filename = ''.join(char for char in filename if char.isprintable())
         
         # Заменяем множественные пробелы и подчеркивания
-        filename = re.sub(r'\s+', '_', filename)
-        filename = re.sub(r'_+', '_', filename)
+        filename = self._ws_re.sub('_', filename)
+        filename = self._us_re.sub('_', filename)
         
         # Обрезаем до максимальной длины
         if len(filename) > max_length:
@@ -57,43 +259,7 @@ class DICOMtoNIIConverter:
     
     def extract_dicom_metadata(self, dcm_file):
         """Извлечение метаданных из DICOM файла"""
-        try:
-            ds = pydicom.dcmread(dcm_file, stop_before_pixels=True, force=True)
-            
-            # Безопасное извлечение текстовых полей
-            def safe_get(field, default=''):
-                try:
-                    value = ds.get(field, default)
-                    if value is None:
-                        return default
-                    return str(value).lower().strip()
-                except:
-                    return default
-            
-            metadata = {
-                'SeriesDescription': safe_get('SeriesDescription'),
-                'ProtocolName': safe_get('ProtocolName'),
-                'SequenceName': safe_get('SequenceName'),
-                'ScanOptions': safe_get('ScanOptions'),
-                'MRAcquisitionType': safe_get('MRAcquisitionType'),
-                'EchoTime': float(ds.get('EchoTime', 0)) if ds.get('EchoTime') else 0,
-                'RepetitionTime': float(ds.get('RepetitionTime', 0)) if ds.get('RepetitionTime') else 0,
-                'InversionTime': float(ds.get('InversionTime', 0)) if ds.get('InversionTime') else 0,
-                'ContrastBolusAgent': safe_get('ContrastBolusAgent'),
-                'ImageType': safe_get('ImageType'),
-                'Modality': safe_get('Modality'),
-                'SeriesNumber': int(ds.get('SeriesNumber', 0)),
-                'InstanceNumber': int(ds.get('InstanceNumber', 0)),
-                'SliceThickness': float(ds.get('SliceThickness', 0)) if ds.get('SliceThickness') else 0,
-                'PixelSpacing': ds.get('PixelSpacing', [1, 1]),
-                'PatientID': safe_get('PatientID'),
-                'StudyDate': safe_get('StudyDate'),
-                'PatientName': safe_get('PatientName')
-            }
-            return metadata
-        except Exception as e:
-            print(f"Ошибка чтения {dcm_file}: {e}")
-            return None
+        return extract_dicom_metadata(dcm_file)
     
     def determine_scan_type(self, metadata, dcm_files_sample):
         """Определение типа скана по метаданным"""
@@ -104,14 +270,8 @@ class DICOMtoNIIConverter:
         protocol = metadata['ProtocolName']
         
         # Проверка на контраст
-        has_contrast = any([
-            '+c' in series_desc,
-            'contrast' in series_desc,
-            'ce' in series_desc,
-            'post' in series_desc,
-            'gd' in series_desc,
-            metadata['ContrastBolusAgent'] != ''
-        ])
+        has_contrast = (metadata['ContrastBolusAgent'] != '' or
+                        self._contrast_re.search(series_desc) is not None)
         
         # Список всех текстовых полей для поиска ключевых слов
         text_fields = [
@@ -123,14 +283,15 @@ class DICOMtoNIIConverter:
         
         text_combined = ' '.join(text_fields)
         
-        # Определение по ключевым словам
-        for scan_type, info in self.scan_types_info.items():
-            for keyword in info['keywords']:
-                if keyword in text_combined:
-                    # Особый случай для T1 с контрастом
-                    if scan_type == 'T1' and has_contrast:
-                        return 'T1-CE'
-                    return scan_type
+        # Определение по ключевым словам: побеждает тип с наименьшим приоритетом
+        priorities = [self._keyword_priority[match.group(1)]
+                      for match in self._keyword_re.finditer(text_combined)]
+        if priorities:
+            scan_type = self._scan_type_order[min(priorities)]
+            # Особый случай для T1 с контрастом
+            if scan_type == 'T1' and has_contrast:
+                return 'T1-CE'
+            return scan_type
         
         # Определение по временным параметрам (если доступны)
         te, tr = metadata['EchoTime'], metadata['RepetitionTime']
@@ -154,45 +315,55 @@ class DICOMtoNIIConverter:
         
         return "Unknown"
     
-    def find_dicom_series(self, folder):
+    def find_dicom_series(self, folder, max_files=None, max_workers=None):
         """Поиск всех серий DICOM в папке и подпапках"""
         dicom_series = {}
         
         # Рекурсивный поиск .dcm файлов
-        dcm_files = []
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file.lower().endswith(('.dcm', '.dicom', '.ima')):
-                    dcm_files.append(os.path.join(root, file))
+        dcm_files = list(iter_dicom_files(folder))
         
         print(f"Найдено {len(dcm_files)} DICOM файлов")
         
-        # Группировка по сериям (используем все файлы для точности)
-        for dcm_file in tqdm(dcm_files[:min(500, len(dcm_files))], desc="Анализ серий"):
-            metadata = self.extract_dicom_metadata(dcm_file)
-            if metadata:
-                series_num = metadata.get('SeriesNumber', 0)
-                series_key = f"{series_num:04d}_{metadata.get('SeriesDescription', 'Unknown')[:50]}"
-                
-                if series_key not in dicom_series:
-                    dicom_series[series_key] = {
-                        'files': [],
-                        'metadata': metadata,
-                        'sample_file': dcm_file
-                    }
-                
-                dicom_series[series_key]['files'].append(dcm_file)
+        # Ограничение на количество анализируемых файлов (по умолчанию все файлы)
+        if max_files is not None:
+            dcm_files = dcm_files[:max_files]
+        
+        # Группировка по сериям, заголовки читаются параллельно во всех ядрах
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            all_metadata = executor.map(extract_dicom_metadata, dcm_files, chunksize=64)
+            
+            for metadata, dcm_file in tqdm(zip(all_metadata, dcm_files), total=len(dcm_files), desc="Анализ серий"):
+                if metadata:
+                    series_num = metadata.get('SeriesNumber', 0)
+                    series_key = f"{series_num:04d}_{metadata.get('SeriesDescription', 'Unknown')[:50]}"
+                    
+                    if series_key not in dicom_series:
+                        dicom_series[series_key] = {
+                            'files': [],
+                            'metadata': metadata,
+                            'sample_file': dcm_file
+                        }
+                    
+                    dicom_series[series_key]['files'].append(dcm_file)
         
         return dicom_series
     
     def sort_dicom_slices(self, filepaths):
-        """Сортировка DICOM срезов по позиции"""
+        """Сортировка DICOM срезов по позиции
+        
+        Возвращает список (позиция, номер инстанса, путь, набор данных). Файлы читаются
+        с отложенной загрузкой крупных элементов, поэтому пиксели из того же набора
+        данных подгружаются только при обращении к pixel_array.
+        """
         slices_info = []
+        # Размеры срезов берутся из тегов Rows/Columns, без декодирования пикселей
+        slice_shapes = set()
         
         for filepath in filepaths:
             try:
-                ds = pydicom.dcmread(filepath, stop_before_pixels=False, force=True)
+                ds = pydicom.dcmread(filepath, defer_size='1 KB', force=True)
                 instance_num = ds.get('InstanceNumber', 0)
+                slice_shapes.add((ds.get('Rows'), ds.get('Columns')))
                 
                 # Используем разные методы определения позиции
                 if hasattr(ds, 'SliceLocation'):
@@ -207,17 +378,40 @@ class DICOMtoNIIConverter:
                 print(f"Ошибка чтения {filepath}: {e}")
                 continue
         
-        # Сортировка по позиции среза
-        slices_info.sort(key=lambda x: (float(x[0]), x[1]))
+        if len(slice_shapes) > 1:
+            print(f"  Предупреждение: размеры срезов различаются: {sorted(slice_shapes, key=str)}")
+        
+        # Сортировка по позиции среза, затем по номеру инстанса (lexsort: последний ключ главный)
+        positions = np.fromiter((float(s[0]) for s in slices_info), dtype=np.float64, count=len(slices_info))
+        instances = np.fromiter((int(s[1]) for s in slices_info), dtype=np.int64, count=len(slices_info))
+        order = np.lexsort((instances, positions))
         
-        return slices_info
+        return [slices_info[i] for i in order]
     
-    def convert_series_to_nifti(self, series_info, output_dir, patient_id):
+    def _allocate_volume(self, shape, dtype, output_dir):
+        """Выделение буфера под объем; большие объемы размещаются в np.memmap
+        
+        Буфер в порядке Fortran: каждый срез volume[..., i] непрерывен в памяти,
+        а nibabel пишет такой массив в NIfTI без перестановки осей.
+        """
+        if np.prod(shape, dtype=np.int64) * np.dtype(dtype).itemsize < self.MEMMAP_THRESHOLD:
+            return np.empty(shape, dtype=dtype, order='F'), None
+        
+        # Страницы файла вытесняются ОС, поэтому объем не держится в памяти целиком
+        fd, tmp_path = tempfile.mkstemp(suffix='.raw', dir=output_dir)
+        os.close(fd)
+        return np.memmap(tmp_path, dtype=dtype, mode='w+', shape=shape, order='F'), tmp_path
+    
+    def convert_series_to_nifti(self, series_info, output_dir, patient_id, decode_workers=None):
         """Конвертация одной серии в NIfTI"""
+        if decode_workers is None:
+            decode_workers = min(8, os.cpu_count() or 1)
+        
         if not series_info['files']:
             print("Нет файлов для конвертации")
             return None
         
+        tmp_path = None
         try:
             # Определение типа скана
             scan_type = self.determine_scan_type(
@@ -227,42 +421,54 @@ class DICOMtoNIIConverter:
             
             print(f"  Тип определен как: {scan_type}")
             
-            # Сортировка срезов
+            # Сортировка срезов, каждый файл разбирается один раз на всю конвертацию
             sorted_slices = self.sort_dicom_slices(series_info['files'])
             
             if not sorted_slices:
                 print("  Не удалось отсортировать срезы")
                 return None
             
-            print(f"  Отсортировано {len(sorted_slices)} срезов")
+            n_slices = len(sorted_slices)
+            print(f"  Отсортировано {n_slices} срезов")
             
-            # Проверяем размеры
-            first_ds = sorted_slices[0][3]
-            first_shape = first_ds.pixel_array.shape
-            consistent = all(s[3].pixel_array.shape == first_shape for s in sorted_slices)
+            # Создание 3D массива, пиксели каждого файла читаются один раз
+            volume = None
+            ds_sample = None
+            rescale = False
             
-            if not consistent:
-                print("  Предупреждение: размеры срезов различаются")
+            # Наборы данных переходят в очередь и отпускаются после копирования пикселей в объем
+            slice_datasets = deque(slice_info[3] for slice_info in sorted_slices)
+            sorted_slices = None
+            decoded = iter_decoded_slices(slice_datasets, max_workers=decode_workers)
             
-            # Создание 3D массива
-            slice_data = []
-            
-            for _, _, filepath, ds in sorted_slices:
-                pixel_array = ds.pixel_array
-                
-                # Преобразование HU для CT
-                if ds.get('Modality') == 'CT':
-                    if hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'):
-                        pixel_array = pixel_array * ds.RescaleSlope + ds.RescaleIntercept
+            for i, (ds, pixel_array) in enumerate(decoded):
+                if volume is None:
+                    # Буфер под весь объем выделяется один раз по первому срезу;
+                    # для CT сразу во float32, чтобы пересчет HU шел на месте
+                    ds_sample = ds
+                    rescale = (ds.get('Modality') == 'CT' and
+                               hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'))
+                    dtype = np.float32 if rescale else pixel_array.dtype
+                    volume, tmp_path = self._allocate_volume(
+                        pixel_array.shape + (n_slices,), dtype, output_dir
+                    )
+                    if rescale:
+                        # Коэффициенты постоянны в пределах серии
+                        slope = float(ds.RescaleSlope)
+                        intercept = float(ds.RescaleIntercept)
                 
-                slice_data.append(pixel_array)
+                # Срезы пишутся без именованных представлений: любое представление
+                # memmap удерживает отображение файла до конца конвертации
+                if rescale:
+                    # Преобразование HU для CT пишется сразу в срез объема, без временных массивов
+                    np.multiply(pixel_array, slope, out=volume[..., i], dtype=np.float32)
+                    volume[..., i] += intercept
+                else:
+                    volume[..., i] = pixel_array
             
-            # Создание 3D массива
-            volume = np.stack(slice_data, axis=-1)
             print(f"  Создан объем размером: {volume.shape}")
             
             # Создание affine матрицы
-            ds_sample = sorted_slices[0][3]
             pixel_spacing = ds_sample.get('PixelSpacing', [1.0, 1.0])
             slice_thickness = ds_sample.get('SliceThickness', 1.0)
             
@@ -282,19 +488,21 @@ class DICOMtoNIIConverter:
             safe_patient_id = self.safe_filename(patient_id[:20])
             safe_series_desc = self.safe_filename(series_desc[:30])
             
-            filename = f"{safe_patient_id}_{scan_type}_S{series_num}_{safe_series_desc}.nii.gz"
+            extension = '.nii.zst' if self.compression == 'zstd' else '.nii.gz'
+            filename = f"{safe_patient_id}_{scan_type}_S{series_num}_{safe_series_desc}{extension}"
             filepath = os.path.join(output_dir, filename)
             
-            # Сохраняем напрямую в .nii.gz
-            nib.save(nii_img, filepath.replace('.gz', ''))
-            
-            # Сжатие в .gz
-            with open(filepath.replace('.gz', ''), 'rb') as f_in:
-                with gzip.open(filepath, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            
-            # Удаляем временный файл
-            os.remove(filepath.replace('.gz', ''))
+            if self.compression == 'zstd':
+                # Многопоточное сжатие zstd: nibabel пишет образ .nii прямо в поток
+                # компрессора, несжатая копия объема в памяти не создается
+                import zstandard as zstd
+                with open(filepath, 'wb') as f_out:
+                    compressor = zstd.ZstdCompressor(level=3, threads=-1)
+                    with compressor.stream_writer(f_out, closefd=False) as writer:
+                        nii_img.to_file_map({'image': nib.FileHolder(fileobj=_TellingWriter(writer))})
+            else:
+                # Сохраняем напрямую в .nii.gz, nibabel сжимает поток сам
+                nib.save(nii_img, filepath)
             
             print(f"  Сохранено: {filename}")
             
@@ -304,7 +512,7 @@ class DICOMtoNIIConverter:
                 'series_number': series_num,
                 'shape': volume.shape,
                 'original_files': len(series_info['files']),
-                'voxel_size': [affine[0, 0], affine[1, 1], affine[2, 2]]
+                'voxel_size': [float(affine[0, 0]), float(affine[1, 1]), float(affine[2, 2])]
             }
             
         except Exception as e:
@@ -312,8 +520,18 @@ class DICOMtoNIIConverter:
             import traceback
             traceback.print_exc()
             return None
+        
+        finally:
+            if tmp_path is not None:
+                # Отображение файла нужно закрыть до удаления (иначе Windows не даст удалить)
+                nii_img = volume = None
+                try:
+                    os.remove(tmp_path)
+                except OSError as e:
+                    # Ошибка очистки не должна отменять уже сохраненный результат
+                    print(f"  Не удалось удалить временный файл {tmp_path}: {e}")
     
-    def process_all_series(self, input_dir=None, output_dir=None):
+    def process_all_series(self, input_dir=None, output_dir=None, max_workers=None):
         """Основная функция обработки всех серий"""
         if input_dir is None:
             input_dir = self.base_path
@@ -334,23 +552,40 @@ class DICOMtoNIIConverter:
         
         print(f"Найдено {len(dicom_series)} серий")
         
-        # Конвертация каждой серии
+        # Конвертация серий параллельно, каждая серия в отдельном процессе
         results = []
         summary = {}
-        
-        for series_key, series_info in dicom_series.items():
-            print(f"\n{'='*60}")
-            print(f"Обработка серии: {series_key}")
-            
-            # Получаем PatientID из метаданных
-            patient_id = series_info['metadata'].get('PatientID', 'Unknown')
-            if patient_id == '' or patient_id == 'unknown':
-                # Пробуем получить из имени файла или папки
-                sample_path = series_info['sample_file']
-                folder_name = os.path.basename(os.path.dirname(os.path.dirname(sample_path)))
-                patient_id = folder_name if folder_name else f"Patient_{datetime.now().strftime('%Y%m%d')}"
-            
-            result = self.convert_series_to_nifti(series_info, output_dir, patient_id)
+        converted = {}
+        
+        if dicom_series:
+            workers = min(max_workers or self.MAX_SERIES_WORKERS, len(dicom_series))
+            # Ядра делятся между процессами, чтобы потоков декодирования не было больше ядер
+            decode_workers = max(1, min(8, (os.cpu_count() or 1) // workers))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for series_key, series_info in dicom_series.items():
+                    # Получаем PatientID из метаданных
+                    patient_id = series_info['metadata'].get('PatientID', 'Unknown')
+                    if patient_id == '' or patient_id == 'unknown':
+                        # Пробуем получить из имени файла или папки
+                        sample_path = series_info['sample_file']
+                        folder_name = os.path.basename(os.path.dirname(os.path.dirname(sample_path)))
+                        patient_id = folder_name if folder_name else f"Patient_{datetime.now().strftime('%Y%m%d')}"
+                    
+                    future = executor.submit(
+                        _convert_one, self, series_key, series_info, output_dir, patient_id, decode_workers
+                    )
+                    futures[future] = series_key
+                
+                for future in as_completed(futures):
+                    try:
+                        converted[futures[future]] = future.result()
+                    except Exception as e:
+                        print(f"  Ошибка при конвертации серии {futures[future]}: {e}")
+        
+        # Итоги собираются в порядке серий, чтобы отчет не зависел от порядка завершения
+        for series_key in dicom_series:
+            result = converted.get(series_key)
             
             if result:
                 results.append(result)
@@ -377,8 +612,16 @@ class DICOMtoNIIConverter:
             'details': results
         }
         
-        with open(report_path, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            # orjson пишет UTF-8 без экранирования и сам сериализует типы NumPy
+            with open(report_path, 'wb') as f:
+                f.write(orjson.dumps(
+                    report,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                ))
+        else:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
         
         print(f"\n{'='*60}")
         print("ОТЧЕТ О КОНВЕРТАЦИИ:")